@@ -2,8 +2,12 @@
 
 import sys
 import os
+import io
 import json
+import tempfile
 import subprocess
+import fnmatch
+from concurrent.futures import ThreadPoolExecutor
 import questionary
 
 # --- Constants ---
@@ -15,6 +19,26 @@ else:
     CONFIG_DIR = os.path.join(os.path.expanduser("~"), ".config", "msc")
 
 CONFIG_FILE = os.path.join(CONFIG_DIR, "config.json")
+SCAN_CACHE_FILE = os.path.join(CONFIG_DIR, "scan_cache.json")
+
+# Only the first bytes of a file are read to decide if it is binary (same heuristic as git)
+BINARY_SNIFF_BYTES = 8000
+
+# Upper bound on the cached scans, the oldest entries are dropped first
+MAX_SCAN_CACHE_ENTRIES = 10000
+
+# Lines of context around a hunk that must be unchanged since its target commit for absorb to pick it
+FIXUP_CONTEXT_LINES = 3
+
+# Defaults for the checks run before staging, overridable in settings.staging_guard
+DEFAULT_STAGING_GUARD = {
+    "enabled": True,
+    "max_file_size_kb": 5120,
+    "flag_binary": True,
+    "deny_patterns": ["core", "core.[0-9]*", "*.dump", "*.o", "*.obj", "*.so", "*.dll", "*.exe", "*.pyc"],
+    "action": "confirm",
+    "workers": 8
+}
 
 # ANSI color codes
 YELLOW = '\033[0;33m'
@@ -54,12 +78,173 @@ def show_help(texts):
     print(f"\n{texts.get('usage_title', 'Usage:')}")
     print(f"  msc add [files..|all|.] - {texts.get('usage_add', 'Add files to stage interactively or directly.')}")
     print(f"  msc commit           - {texts.get('usage_commit', 'Interactively create a semantic commit.')}")
+    print(f"  msc absorb           - {texts.get('usage_absorb', 'Turn staged changes into fixup commits for unpublished commits.')}")
     print(f"  msc push             - {texts.get('usage_push', 'Push commits to the remote repository with a safety check.')}")
     print(f"  msc config --lang <en|pt> - {texts.get('usage_config', 'Change the display language.')}")
     print(f"  msc update           - {texts.get('usage_update', 'Check for new updates.')}")
     print(f"  msc --version, -v    - {texts.get('usage_version', 'Show the current version of the tool.')}")
     print(f"  msc --help           - {texts.get('usage_help', 'Show this help message.')}")
 
+def get_staging_guard_settings(config):
+    """Returns the staging guard settings, filling missing keys with the defaults."""
+    guard = dict(DEFAULT_STAGING_GUARD)
+    guard.update(config.get("settings", {}).get("staging_guard", {}))
+    return guard
+
+def load_scan_cache():
+    """Loads the cached file scans. A missing or corrupted cache is just treated as empty."""
+    try:
+        with open(SCAN_CACHE_FILE, "r") as f:
+            cache = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+    if not isinstance(cache, dict):
+        return {}
+    return {path: scan for path, scan in cache.items() if isinstance(scan, list)}
+
+def save_scan_cache(cache):
+    """
+    Saves the cached file scans, dropping entries for files that no longer exist and
+    keeping only the most recent ones. Errors are ignored since the cache is only an optimization.
+    """
+    cache = {path: scan for path, scan in cache.items() if os.path.exists(path)}
+    cache = dict(list(cache.items())[-MAX_SCAN_CACHE_ENTRIES:])
+    try:
+        with open(SCAN_CACHE_FILE, "w") as f:
+            json.dump(cache, f)
+    except OSError:
+        pass
+
+def get_repo_root():
+    """Returns the absolute path of the top level of the current git repository."""
+    result = subprocess.run(['git', 'rev-parse', '--show-toplevel'], capture_output=True, text=True, check=True)
+    return result.stdout.strip()
+
+def get_worktree_changes(pathspecs):
+    """Returns the paths (relative to the repo root) with working tree changes that 'git add' would stage."""
+    result = subprocess.run(
+        ['git', 'status', '--porcelain', '-z', '--untracked-files=all', '--'] + pathspecs,
+        capture_output=True, text=True, check=True
+    )
+    entries = iter(result.stdout.split('\0'))
+    changed_files = []
+    for entry in entries:
+        if not entry:
+            continue
+        # Renames and copies (in the index or the working tree) are followed by an extra entry with the original path
+        if entry[0] in 'RC' or entry[1] in 'RC':
+            next(entries, None)
+        if entry[1] != ' ':
+            changed_files.append(entry[3:])
+    return changed_files
+
+def get_add_pathspecs(add_args):
+    """Returns the pathspecs 'git add' will stage for the given arguments, so the guard scans the same files."""
+    if '--' in add_args:
+        separator = add_args.index('--')
+        flags, pathspecs = add_args[:separator], add_args[separator + 1:]
+    else:
+        flags = [arg for arg in add_args if arg.startswith('-')]
+        pathspecs = [arg for arg in add_args if not arg.startswith('-')]
+    # Without pathspecs, '-A' and '-u' stage changes from the whole repository
+    stages_everything = any(
+        flag in ('--all', '--update') or (not flag.startswith('--') and ('A' in flag or 'u' in flag))
+        for flag in flags
+    )
+    if not pathspecs and stages_everything:
+        return [':/']
+    return pathspecs
+
+def scan_file(file_path, cached):
+    """
+    Stats a file and checks if it is binary by reading a bounded prefix.
+    Returns the scan as [size, mtime, inode, is_binary], or None if the file can't be read.
+    The binary check is reused from 'cached' when size, mtime and inode are unchanged.
+    """
+    try:
+        st = os.stat(file_path)
+        signature = [st.st_size, st.st_mtime_ns, st.st_ino]
+        if cached and cached[:3] == signature:
+            return cached
+        with open(file_path, "rb") as f:
+            is_binary = b'\0' in f.read(BINARY_SNIFF_BYTES)
+        return signature + [is_binary]
+    except OSError:
+        return None
+
+def format_size(size):
+    """Formats a size in bytes for display."""
+    for unit in ['B', 'KB', 'MB']:
+        if size < 1024:
+            return f"{size:.0f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+def find_flagged_files(config, texts, file_paths):
+    """
+    Scans the files about to be staged on a thread pool and returns a dict
+    mapping each file that should not be staged silently to its reasons.
+    """
+    guard = get_staging_guard_settings(config)
+    if not guard.get("enabled") or not file_paths:
+        return {}
+
+    repo_root = get_repo_root()
+    max_size = guard.get("max_file_size_kb", 0) * 1024
+    deny_patterns = guard.get("deny_patterns", [])
+    cache = load_scan_cache()
+
+    full_paths = [os.path.join(repo_root, file_path) for file_path in file_paths]
+    with ThreadPoolExecutor(max_workers=max(1, guard.get("workers", 1))) as executor:
+        scans = list(executor.map(lambda path: scan_file(path, cache.get(path)), full_paths))
+
+    flagged = {}
+    for file_path, full_path, scan in zip(file_paths, full_paths, scans):
+        if scan is None:
+            continue
+        # Re-insert so recently scanned files are the last to be dropped from the cache
+        cache.pop(full_path, None)
+        cache[full_path] = scan
+        size, is_binary = scan[0], scan[3]
+        reasons = []
+        if any(fnmatch.fnmatch(file_path, p) or fnmatch.fnmatch(os.path.basename(file_path), p) for p in deny_patterns):
+            reasons.append(texts.get('guard_reason_denied', "matches a deny pattern"))
+        if max_size and size > max_size:
+            reasons.append(texts.get('guard_reason_size', "large file: {size}").format(size=format_size(size)))
+        if guard.get("flag_binary") and is_binary:
+            reasons.append(texts.get('guard_reason_binary', "binary file"))
+        if reasons:
+            flagged[file_path] = reasons
+
+    save_scan_cache(cache)
+    return flagged
+
+def select_excluded_files(config, texts, flagged):
+    """Shows the flagged files and returns the ones that should be left out of the stage."""
+    if not flagged:
+        return []
+
+    print(YELLOW + texts.get('guard_flagged_title', "The following files look like they should not be committed:") + NC)
+    for file_path, reasons in flagged.items():
+        print(f"  - {file_path} ({', '.join(reasons)})")
+
+    if get_staging_guard_settings(config).get("action") == "exclude":
+        excluded_files = list(flagged)
+    else:
+        keep_files = questionary.checkbox(
+            texts.get('guard_select_keep', "Select the flagged files to stage anyway:"),
+            choices=list(flagged),
+            instruction=texts.get('select_files_instruction', " ")
+        ).ask()
+        if keep_files is None: raise KeyboardInterrupt()
+        excluded_files = [file_path for file_path in flagged if file_path not in keep_files]
+
+    if excluded_files:
+        print(YELLOW + texts.get('guard_excluded', "These files were not staged.") + NC)
+        for file_path in excluded_files:
+            print(f"  - {file_path}")
+    return excluded_files
+
 def handle_add(config, texts, add_args):
     """Handles the 'add' command to interactively or directly stage files."""
     try:
@@ -83,6 +268,9 @@ def handle_add(config, texts, add_args):
                 choices=changed_files,
                 instruction=texts.get('select_files_instruction', " ")
             ).ask()
+            if selected_files:
+                excluded_files = select_excluded_files(config, texts, find_flagged_files(config, texts, selected_files))
+                selected_files = [file_path for file_path in selected_files if file_path not in excluded_files]
             if selected_files:
                 for file_path in selected_files:
                     subprocess.run(['git', 'add', file_path], check=True)
@@ -90,7 +278,19 @@ def handle_add(config, texts, add_args):
         else:
             # Direct mode
             processed_args = ['.' if arg.lower() == 'all' else arg for arg in add_args]
-            command = ['git', 'add'] + processed_args
+            pathspecs = get_add_pathspecs(processed_args)
+            changed_files = get_worktree_changes(pathspecs) if pathspecs else []
+            flagged = find_flagged_files(config, texts, changed_files)
+            excluded_files = select_excluded_files(config, texts, flagged)
+            if excluded_files and set(changed_files) <= set(excluded_files):
+                print(YELLOW + texts.get('guard_nothing_staged', "No files were staged.") + NC)
+                return
+            # Paths from 'git status' are relative to the repo root, hence the 'top' magic
+            exclude_specs = [f":(top,exclude,literal){file_path}" for file_path in excluded_files]
+            # Exclude-only pathspecs would limit '-A' and '-u' to the current directory
+            if pathspecs == [':/'] and exclude_specs:
+                exclude_specs = [':/'] + exclude_specs
+            command = ['git', 'add'] + processed_args + exclude_specs
             subprocess.run(command, check=True, capture_output=True)
             files_str = ", ".join(processed_args)
             print(GREEN + texts.get('files_added_direct', "Added to stage: {files}").format(files=files_str) + NC)
@@ -143,6 +343,240 @@ def handle_commit(config, texts):
         print(f"\n{YELLOW}Operation cancelled by user.{NC}")
         sys.exit(0)
 
+def get_unpublished_commits():
+    """Returns the commits on the current branch that are not on any remote, newest first."""
+    result = subprocess.run(['git', 'rev-list', 'HEAD', '--not', '--remotes'], capture_output=True, text=True, check=True)
+    return result.stdout.split()
+
+def split_lines(content):
+    """Splits content into lines the way git numbers them, on '\\n' only and keeping the line endings."""
+    return io.BytesIO(content).readlines()
+
+def hunk_applies(head_lines, hunk, target_content):
+    """
+    Checks that a hunk (in HEAD line numbers) still applies to the target commit's version of the file,
+    with the same lines of context around it that 'git rebase' relies on. When a later commit touched
+    the lines around the hunk, that context differs and squashing the fixup would conflict.
+    """
+    old_start, old_count, _ = hunk
+    first = old_start - 1 if old_count else old_start
+    start = max(0, first - FIXUP_CONTEXT_LINES)
+    end = min(len(head_lines), first + old_count + FIXUP_CONTEXT_LINES)
+    preimage = b''.join(head_lines[start:end])
+    # Context cut short by the start or end of the file must match there as well
+    if start == 0 and end == len(head_lines):
+        return target_content == preimage
+    if start == 0:
+        return target_content.startswith(preimage)
+    if end == len(head_lines):
+        prefix = target_content[:len(target_content) - len(preimage)]
+        return target_content.endswith(preimage) and (not prefix or prefix.endswith(b'\n'))
+    position = target_content.find(preimage)
+    while position != -1:
+        if position == 0 or target_content[position - 1:position] == b'\n':
+            return True
+        position = target_content.find(preimage, position + 1)
+    return False
+
+def get_staged_hunks(repo_root, file_path):
+    """
+    Returns the staged hunks of a file as (old_start, old_count, new_lines) tuples,
+    or None if the change can't be absorbed (binary files or mode changes).
+    """
+    result = subprocess.run(
+        ['git', '--literal-pathspecs', 'diff', '--cached', '--no-color', '--no-ext-diff', '--no-textconv', '-U0', '--', file_path],
+        capture_output=True, check=True, cwd=repo_root
+    )
+    hunks = []
+    in_hunks = False
+    last_line_added = False
+    for line in split_lines(result.stdout):
+        if line.startswith(b'diff --git') and in_hunks:
+            # Only the first file of the diff is the one asked for
+            break
+        if line.startswith(b'@@'):
+            # Header format: @@ -old_start[,old_count] +new_start[,new_count] @@
+            old_range = line.split(b' ')[1][1:].split(b',')
+            old_start = int(old_range[0])
+            old_count = int(old_range[1]) if len(old_range) > 1 else 1
+            hunks.append((old_start, old_count, []))
+            in_hunks = True
+        elif not in_hunks:
+            if line.startswith((b'old mode', b'Binary files', b'GIT binary patch')):
+                return None
+        elif line.startswith(b'+'):
+            hunks[-1][2].append(line[1:])
+            last_line_added = True
+            continue
+        elif line.startswith(b'\\') and last_line_added:
+            # '\ No newline at end of file' applies to the line right before it
+            hunks[-1][2][-1] = hunks[-1][2][-1].rstrip(b'\n')
+        last_line_added = False
+    return hunks
+
+def blame_lines(repo_root, file_path, line_numbers, unpublished):
+    """Returns a dict mapping each of the given HEAD line numbers to the commit that last touched it."""
+    if not line_numbers:
+        return {}
+    # Merge consecutive lines into ranges to keep the command line short
+    ranges = []
+    for line_number in sorted(line_numbers):
+        if ranges and ranges[-1][1] == line_number - 1:
+            ranges[-1][1] = line_number
+        else:
+            ranges.append([line_number, line_number])
+    command = ['git', '--literal-pathspecs', 'blame', '--porcelain', '--no-textconv']
+    for start, end in ranges:
+        command += ['-L', f"{start},{end}"]
+    # Lines older than the unpublished range are attributed to a boundary commit,
+    # so blame never has to walk the published history
+    command += ['HEAD', '--not', '--remotes', '--', file_path]
+    result = subprocess.run(command, capture_output=True, text=True, errors='replace', check=True, cwd=repo_root)
+    blamed = {}
+    for line in result.stdout.splitlines():
+        parts = line.split(' ')
+        if len(parts) in (3, 4) and len(parts[0]) == 40 and parts[0] in unpublished:
+            blamed[int(parts[2])] = parts[0]
+    return blamed
+
+def find_absorb_targets(repo_root, file_path, unpublished):
+    """
+    Matches each staged hunk of a file to the unpublished commit that last touched its lines.
+    Returns a list of (hunk, target) pairs, where target is None for hunks that can't be matched.
+    """
+    hunks = get_staged_hunks(repo_root, file_path)
+    if not hunks:
+        return []
+    head_content = subprocess.run(['git', 'show', f"HEAD:{file_path}"], capture_output=True, check=True, cwd=repo_root).stdout
+    head_lines = split_lines(head_content)
+
+    def hunk_lines(hunk):
+        old_start, old_count, _ = hunk
+        if old_count:
+            return list(range(old_start, old_start + old_count))
+        # Pure additions have no lines of their own, so use the lines around them
+        return [n for n in (old_start, old_start + 1) if 1 <= n <= len(head_lines)]
+
+    blamed = blame_lines(repo_root, file_path, {n for hunk in hunks for n in hunk_lines(hunk)}, unpublished)
+    target_contents = {}
+    matches = []
+    for hunk in hunks:
+        targets = {blamed.get(n) for n in hunk_lines(hunk)}
+        # Only absorb a hunk when all of its lines come from a single unpublished commit
+        target = targets.pop() if len(targets) == 1 else None
+        if target:
+            if target not in target_contents:
+                # The file may not exist under this path in the target (blame follows renames)
+                show = subprocess.run(['git', 'show', f"{target}:{file_path}"], capture_output=True, cwd=repo_root)
+                target_contents[target] = show.stdout if show.returncode == 0 else None
+            if target_contents[target] is None or not hunk_applies(head_lines, hunk, target_contents[target]):
+                target = None
+        matches.append((hunk, target))
+    return matches
+
+def apply_hunks(content, hunks):
+    """Applies zero-context hunks (in HEAD line numbers) to the HEAD content of a file."""
+    lines = split_lines(content)
+    for old_start, old_count, new_lines in sorted(hunks, reverse=True):
+        start = old_start - 1 if old_count else old_start
+        lines[start:start + old_count] = new_lines
+    return b''.join(lines)
+
+def create_fixup_commits(repo_root, fixups):
+    """
+    Creates one 'fixup!' commit per target from the given {target: {file_path: hunks}} mapping.
+    The commits are built in a temporary index from the HEAD content, so neither the working tree
+    nor the real index are touched and whatever was not absorbed is left staged afterwards.
+    """
+    original_head = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True, cwd=repo_root).stdout.strip()
+    applied = {}
+    with tempfile.TemporaryDirectory() as temp_dir:
+        env = dict(os.environ, GIT_INDEX_FILE=os.path.join(temp_dir, 'index'))
+        subprocess.run(['git', 'read-tree', original_head], check=True, capture_output=True, cwd=repo_root, env=env)
+        for target, files in fixups.items():
+            for file_path, hunks in files.items():
+                applied.setdefault(file_path, []).extend(hunks)
+                ls_tree = subprocess.run(['git', '--literal-pathspecs', 'ls-tree', original_head, '--', file_path], capture_output=True, text=True, check=True, cwd=repo_root)
+                mode = ls_tree.stdout.split(' ')[0]
+                # Always patch the original HEAD content, since the hunk line numbers refer to it
+                content = subprocess.run(['git', 'show', f"{original_head}:{file_path}"], capture_output=True, check=True, cwd=repo_root).stdout
+                blob = subprocess.run(
+                    ['git', 'hash-object', '-w', '--stdin'],
+                    input=apply_hunks(content, applied[file_path]), capture_output=True, check=True, cwd=repo_root
+                ).stdout.decode().strip()
+                subprocess.run(['git', 'update-index', '--cacheinfo', f"{mode},{blob},{file_path}"], check=True, capture_output=True, cwd=repo_root, env=env)
+            subprocess.run(['git', 'commit', '-q', '--no-verify', f"--fixup={target}"], check=True, capture_output=True, cwd=repo_root, env=env)
+
+def handle_absorb(config, texts):
+    """Handles the 'absorb' command to turn staged hunks into fixup commits for unpublished commits."""
+    try:
+        result = subprocess.run(['git', 'diff', '--cached', '--quiet'], capture_output=True, text=True)
+        if result.returncode == 0:
+            print(YELLOW + texts.get('no_files_to_commit', "Error: No files staged for commit.") + NC)
+            return
+
+        unpublished = get_unpublished_commits()
+        if not unpublished:
+            print(YELLOW + texts.get('absorb_no_unpublished', "There are no unpublished commits to absorb changes into.") + NC)
+            return
+
+        # Paths are relative to the repo root, so every git call below runs from there
+        repo_root = get_repo_root()
+        # Only modified files can have hunks that belong to an earlier commit
+        result = subprocess.run(
+            ['git', 'diff', '--cached', '--name-only', '-z', '--no-renames', '--diff-filter=M'],
+            capture_output=True, text=True, check=True, cwd=repo_root
+        )
+        file_paths = [file_path for file_path in result.stdout.split('\0') if file_path]
+        unpublished_set = set(unpublished)
+        with ThreadPoolExecutor() as executor:
+            matches = list(executor.map(lambda file_path: find_absorb_targets(repo_root, file_path, unpublished_set), file_paths))
+
+        fixups = {}
+        absorbed = 0
+        for file_path, file_matches in zip(file_paths, matches):
+            for hunk, target in file_matches:
+                if target:
+                    fixups.setdefault(target, {}).setdefault(file_path, []).append(hunk)
+                    absorbed += 1
+
+        if not fixups:
+            print(YELLOW + texts.get('absorb_no_matches', "No staged hunk could be matched to an unpublished commit.") + NC)
+            return
+
+        # Create the fixups oldest first, following the branch history
+        fixups = {target: fixups[target] for target in reversed(unpublished) if target in fixups}
+        print(texts.get('absorb_preview_title', "The following fixup commits will be created:"))
+        for target, files in fixups.items():
+            subject = subprocess.run(['git', 'log', '-1', '--format=%h %s', target], capture_output=True, text=True, check=True).stdout.strip()
+            print(f"  fixup! {subject}")
+            for file_path, hunks in files.items():
+                print(f"    - {file_path} ({len(hunks)})")
+
+        confirmation = questionary.confirm(texts.get('absorb_confirm', "Create these fixup commits?")).ask()
+        if confirmation is None: raise KeyboardInterrupt()
+        if not confirmation:
+            print(YELLOW + texts.get('absorb_cancelled', "No fixup commits were created.") + NC)
+            return
+
+        create_fixup_commits(repo_root, fixups)
+        print(GREEN + texts.get('absorb_successful', "Created {count} fixup commit(s).").format(count=len(fixups)) + NC)
+        remaining = subprocess.run(['git', 'diff', '--cached', '--quiet'], capture_output=True, text=True)
+        if remaining.returncode != 0:
+            print(YELLOW + texts.get('absorb_left_staged', "Changes that could not be absorbed are still staged.") + NC)
+        print(texts.get('absorb_autosquash_hint', "Run 'git rebase -i --autosquash' to squash them into their targets."))
+    except FileNotFoundError:
+        print(f"{RED}Error: 'git' command not found. Is Git installed and in your PATH?{NC}")
+        sys.exit(1)
+    except subprocess.CalledProcessError as e:
+        # Most git calls of absorb run in bytes mode
+        stderr = e.stderr.decode('utf-8', errors='replace') if isinstance(e.stderr, bytes) else e.stderr
+        print(f"{RED}An error occurred while running git: {stderr}{NC}")
+        sys.exit(1)
+    except (KeyboardInterrupt, TypeError):
+        print(f"\n{YELLOW}Operation cancelled by user.{NC}")
+        sys.exit(0)
+
 def handle_push(config, texts):
     """Handles the 'push' command with a safety check for main/master branches."""
     try:
@@ -566,6 +1000,8 @@ def main():
         handle_add(config, texts, args[1:])
     elif command == "commit":
         handle_commit(config, texts)
+    elif command == "absorb":
+        handle_absorb(config, texts)
     elif command == "push":
         handle_push(config, texts)
     elif command == "config":